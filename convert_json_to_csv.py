@@ -1,28 +1,77 @@
 import os
-import json
+import orjson
 import csv
 import glob
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# Define the specific columns we want to keep
+TARGET_COLUMNS = ['title', 'link', 'snippet', 'date_clean', 'full_content']
+
+# Top-level keys whose nested dicts would flatten into a target column name,
+# e.g. {"date": {"clean": ...}} -> "date_clean"
+_COLUMN_PREFIXES = {
+    col[:i] for col in TARGET_COLUMNS for i, ch in enumerate(col) if ch == '_'
+}
+
+# Replace newlines and carriage returns with a space in a single pass
+_NL_TABLE = str.maketrans({'\n': ' ', '\r': ' '})
 
 def flatten_json(y):
     out = {}
+    # Iterative walk; keys are kept as tuples and joined once at the leaf
+    stack = [(y, ())]
 
-    def flatten(x, name=''):
-        if type(x) is dict:
-            for a in x:
-                flatten(x[a], name + a + '_')
-        elif type(x) is list:
+    while stack:
+        node, prefix = stack.pop()
+        t = type(node)
+        if t is dict:
+            # Push in reverse so children are visited in document order
+            stack.extend((v, prefix + (k,)) for k, v in reversed(node.items()))
+        elif t is list:
             # For lists, we'll just join them with a semicolon or keep as string
             # But here we assume simple lists or ignore deep nesting in lists for now
-            out[name[:-1]] = str(x)
+            out["_".join(prefix)] = str(node)
         else:
-            if isinstance(x, str):
-                # Replace newlines and carriage returns with a space
-                x = x.replace('\n', ' ').replace('\r', ' ')
-            out[name[:-1]] = x
+            if t is str:
+                node = node.translate(_NL_TABLE)
+            out["_".join(prefix)] = node
 
-    flatten(y)
     return out
 
+def extract_columns(data):
+    # The target columns are top-level scalars in raw_content, so read them
+    # directly and skip walking nested metadata. Fall back to a full flatten
+    # when a column is missing or nested, or when a nested dict could flatten
+    # into (and override) a column, so the output matches flatten_json.
+    if type(data) is not dict:
+        return flatten_json(data)
+    for prefix in _COLUMN_PREFIXES:
+        if type(data.get(prefix)) is dict:
+            return flatten_json(data)
+    row = {}
+    for col in TARGET_COLUMNS:
+        if col not in data:
+            return flatten_json(data)
+        value = data[col]
+        t = type(value)
+        if t is dict:
+            return flatten_json(data)
+        if t is list:
+            value = str(value)
+        elif t is str:
+            value = value.translate(_NL_TABLE)
+        row[col] = value
+    return row
+
+def _process(file_path):
+    # Runs in a worker process: parse + extract one file
+    try:
+        with open(file_path, 'rb') as f:
+            return file_path, extract_columns(orjson.loads(f.read())), None
+    except Exception as e:
+        return file_path, None, str(e)
+
 def main():
     source_dir = 'raw_content'
     output_file = 'combined_data.csv'
@@ -34,35 +83,27 @@ def main():
         print("No JSON files found in", source_dir)
         return
 
-    all_data = []
-    all_keys = set()
-
-    print(f"Found {len(json_files)} JSON files. Processing...")
-
-    for file_path in json_files:
-        try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                # Flatten the data
-                flat_data = flatten_json(data)
-                all_data.append(flat_data)
-                all_keys.update(flat_data.keys())
-        except Exception as e:
-            print(f"Error processing {file_path}: {e}")
+    print(f"Found {len(json_files)} JSON files. Writing to {output_file} with columns: {TARGET_COLUMNS}...")
 
-    # Define the specific columns we want to keep
-    target_columns = ['title', 'link', 'snippet', 'date_clean', 'full_content']
-
-    print(f"Writing {len(all_data)} records to {output_file} with columns: {target_columns}...")
-    
+    written = 0
     try:
         with open(output_file, 'w', newline='', encoding='utf-8') as csvfile:
-            writer = csv.DictWriter(csvfile, fieldnames=target_columns, extrasaction='ignore')
+            writer = csv.DictWriter(csvfile, fieldnames=TARGET_COLUMNS, extrasaction='ignore')
             writer.writeheader()
-            for row in all_data:
-                writer.writerow(row)
-        print("Done!")
-    except Exception as e:
+            # Parse in parallel across cores, write serially on this process
+            with ProcessPoolExecutor() as ex:
+                try:
+                    for file_path, row, err in ex.map(_process, json_files, chunksize=32):
+                        if err is not None:
+                            print(f"Error processing {file_path}: {err}")
+                            continue
+                        writer.writerow(row)
+                        written += 1
+                except BrokenProcessPool as e:
+                    print(f"Worker process pool failed after {written} records: {e}")
+                    return
+        print(f"Done! Wrote {written} records.")
+    except (OSError, csv.Error) as e:
         print(f"Error writing CSV: {e}")
 
 if __name__ == "__main__":
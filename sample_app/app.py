@@ -1,16 +1,36 @@
 ﻿from __future__ import annotations
 
+import hashlib
 import json
 import os
+import queue
+import re
+import threading
+import time
+from functools import lru_cache
+from itertools import repeat
 from pathlib import Path
-from typing import Any, Dict
+from typing import Any, Dict, Iterator
 
-from flask import Flask, jsonify, render_template_string, request
+from flask import Flask, Response, jsonify, request
+from flask.json.provider import DefaultJSONProvider
 
 try:
     import joblib
 except Exception:  # pragma: no cover
     joblib = None  # type: ignore
+try:
+    import orjson
+except Exception:  # pragma: no cover
+    orjson = None  # type: ignore
+try:
+    import numpy as np
+    from scipy import sparse
+    from sklearn.preprocessing import normalize
+except Exception:  # pragma: no cover
+    np = None  # type: ignore
+    sparse = None  # type: ignore
+    normalize = None  # type: ignore
 try:
     from transformers import pipeline
 except Exception:  # pragma: no cover
@@ -22,137 +42,353 @@ ROOT_DIR = APP_DIR.parent
 MODEL_PATH = Path(os.environ.get("MODEL_PATH", ROOT_DIR / "sentiment_model_final.pkl"))
 VECTORIZER_PATH = Path(os.environ.get("VECTORIZER_PATH", ROOT_DIR / "tfidf_vectorizer.pkl"))
 TRANSFORMER_PATH = Path(os.environ.get("TRANSFORMER_PATH", ROOT_DIR / "model_pajak_final_fix"))
+# Micro-batching for single-text requests; a window of 0 disables it.
+BATCH_WINDOW_MS = float(os.environ.get("BATCH_WINDOW_MS", 5))
+BATCH_MAX_SIZE = int(os.environ.get("BATCH_MAX_SIZE", 64))
+# Upper bound on how long a request waits for the batch worker.
+BATCH_TIMEOUT_S = float(os.environ.get("BATCH_TIMEOUT_S", 30))
+# Store linear weights as CSR when fewer than this fraction are non-zero.
+COEF_SPARSE_DENSITY = float(os.environ.get("COEF_SPARSE_DENSITY", 0.3))
+# Memory-map large arrays from uncompressed joblib pickles (shared across workers).
+MODEL_MMAP = os.environ.get("MODEL_MMAP", "1") == "1"
+
+
+class ORJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by orjson."""
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        return orjson.dumps(obj, default=self.default, option=orjson.OPT_SERIALIZE_NUMPY).decode()
+
+    def loads(self, s: str | bytes, **kwargs: Any) -> Any:
+        return orjson.loads(s)
+
 
 app = Flask(__name__)
+if orjson is not None:
+    app.json = ORJSONProvider(app)
 
 MODEL = None
 VECTORIZER = None
 MODEL_ERROR = None
 PIPELINE = None
+# Classic-model metadata, cached at load so requests skip per-call lookups.
+CLASS_STR_LIST: list[str] = []
+HAS_PROBA = False
+HAS_DECISION = False
+_ASSETS_LOADED = False
+
+
+def _install_fast_tfidf(vectorizer: Any) -> None:
+    # Older scikit-learn pickles apply idf via a sparse diagonal matmul, which
+    # copies X; scale X.data in place instead. Newer versions already do this.
+    tfidf = getattr(vectorizer, "_tfidf", None)
+    idf_diag = getattr(tfidf, "_idf_diag", None)
+    if idf_diag is None or np is None or normalize is None:
+        return
+    idf = np.asarray(idf_diag.diagonal(), dtype=np.float32)
+
+    def fast_transform(X: Any, copy: bool = True) -> Any:
+        X = X.tocsr().astype(np.float32, copy=copy)
+        if tfidf.sublinear_tf:
+            np.log(X.data, X.data)
+            X.data += 1.0
+        np.multiply(X.data, idf.take(X.indices), out=X.data)
+        if tfidf.norm is not None:
+            X = normalize(X, norm=tfidf.norm, copy=False)
+        return X
+
+    tfidf.transform = fast_transform
+
+
+def _estimators(model: Any) -> list[Any]:
+    # The model itself plus the fitted inner estimators of a
+    # CalibratedClassifierCV (how llm.ipynb exports its LinearSVC).
+    found = [model]
+    for calibrated in getattr(model, "calibrated_classifiers_", []):
+        inner = getattr(calibrated, "estimator", None)
+        if inner is None:
+            inner = getattr(calibrated, "base_estimator", None)
+        if inner is not None:
+            found.append(inner)
+    return found
+
+
+def _should_downcast(value: Any) -> bool:
+    # Memory-mapped arrays are left alone: casting would copy them onto the
+    # private heap and undo MODEL_MMAP. llm.ipynb exports float32 already.
+    return (
+        isinstance(value, np.ndarray)
+        and not isinstance(value, np.memmap)
+        and value.dtype == np.float64
+    )
+
+
+def _downcast_float32(model: Any, vectorizer: Any) -> None:
+    # Sparse x dense predict is bandwidth-bound; float32 halves the bytes moved.
+    if np is None:
+        return
+    if hasattr(vectorizer, "dtype"):
+        vectorizer.dtype = np.float32
+    tfidf = getattr(vectorizer, "_tfidf", None)
+    state = vars(tfidf) if tfidf is not None else {}
+    if _should_downcast(state.get("idf_")):
+        tfidf.idf_ = state["idf_"].astype(np.float32)
+    idf_diag = state.get("_idf_diag")
+    if idf_diag is not None and not isinstance(getattr(idf_diag, "data", None), np.memmap):
+        tfidf._idf_diag = idf_diag.astype(np.float32)
+
+    # Linear weights (LinearSVC, LogisticRegression) and MultinomialNB log-probs.
+    for est in _estimators(model):
+        for name in ("coef_", "intercept_", "feature_log_prob_", "class_log_prior_"):
+            value = vars(est).get(name)
+            if _should_downcast(value):
+                setattr(est, name, value.astype(np.float32))
+
+
+def _sparsify_coef(model: Any) -> None:
+    # Mostly-zero weights (e.g. L1-trained) skip zero columns in a sparse dot.
+    # MultinomialNB has no coef_ and is left as is.
+    if np is None:
+        return
+    for est in _estimators(model):
+        coef = vars(est).get("coef_")
+        if not isinstance(coef, np.ndarray):
+            continue
+        mask = np.abs(coef) > 1e-6
+        if mask.mean() < COEF_SPARSE_DENSITY:
+            est.coef_ = sparse.csr_matrix(np.where(mask, coef, 0))
+
+
+def _has_transformer() -> bool:
+    return TRANSFORMER_PATH.exists() and (TRANSFORMER_PATH / "config.json").exists()
 
 
 def _load_assets() -> None:
     global MODEL, VECTORIZER, MODEL_ERROR, PIPELINE
-    MODEL = None
-    VECTORIZER = None
-    PIPELINE = None
+    global CLASS_STR_LIST, HAS_PROBA, HAS_DECISION, _ASSETS_LOADED
+    # Build everything in locals and publish at the end, so concurrent
+    # requests never see a model that is still being patched.
+    model = None
+    vectorizer = None
+    pipe = None
+    error = None
+    class_str_list: list[str] = []
+    has_proba = False
+    has_decision = False
 
     # Prefer transformer model if directory exists
-    if TRANSFORMER_PATH.exists() and (TRANSFORMER_PATH / "config.json").exists():
+    if _has_transformer():
         if pipeline is None:
-            MODEL_ERROR = "transformers is not installed. Install dependencies first."
-            return
+            error = "transformers is not installed. Install dependencies first."
+        else:
+            try:
+                pipe = pipeline(
+                    "sentiment-analysis",
+                    model=str(TRANSFORMER_PATH),
+                    tokenizer=str(TRANSFORMER_PATH),
+                )
+            except Exception as exc:  # pragma: no cover
+                error = f"Failed to load transformer model: {exc}"
+    elif joblib is None:
+        error = "joblib is not installed. Install dependencies first."
+    else:
         try:
-            PIPELINE = pipeline(
-                "sentiment-analysis",
-                model=str(TRANSFORMER_PATH),
-                tokenizer=str(TRANSFORMER_PATH),
-            )
-            MODEL_ERROR = None
-            return
+            mmap_mode = "r" if MODEL_MMAP else None
+            vectorizer = joblib.load(VECTORIZER_PATH, mmap_mode=mmap_mode)
+            model = joblib.load(MODEL_PATH, mmap_mode=mmap_mode)
+            _install_fast_tfidf(vectorizer)
+            _downcast_float32(model, vectorizer)
+            _sparsify_coef(model)
+            class_str_list = [str(c) for c in getattr(model, "classes_", [])]
+            has_proba = hasattr(model, "predict_proba")
+            has_decision = hasattr(model, "decision_function")
         except Exception as exc:  # pragma: no cover
-            MODEL_ERROR = f"Failed to load transformer model: {exc}"
-            return
+            model = None
+            vectorizer = None
+            error = f"Failed to load model assets: {exc}"
 
-    if joblib is None:
-        MODEL_ERROR = "joblib is not installed. Install dependencies first."
-        return
-    try:
-        VECTORIZER = joblib.load(VECTORIZER_PATH)
-        MODEL = joblib.load(MODEL_PATH)
-        MODEL_ERROR = None
-    except Exception as exc:  # pragma: no cover
-        MODEL = None
-        VECTORIZER = None
-        MODEL_ERROR = f"Failed to load model assets: {exc}"
-        return
+    MODEL, VECTORIZER, PIPELINE, MODEL_ERROR = model, vectorizer, pipe, error
+    CLASS_STR_LIST, HAS_PROBA, HAS_DECISION = class_str_list, has_proba, has_decision
+    _vectorize_cached.cache_clear()
+    # Set last: _ensure_assets checks this without taking the lock.
+    _ASSETS_LOADED = True
 
 
+_WS = re.compile(r"\s+")
+
 
 def _basic_preprocess(text: str) -> str:
-    return " ".join(text.strip().split())
+    return _WS.sub(" ", text).strip()
+
 
+@lru_cache(maxsize=4096)
+def _vectorize_cached(cleaned: str) -> Any:
+    # Memoize single-text TF-IDF rows; repeated inputs skip re-tokenizing.
+    return VECTORIZER.transform([cleaned])
 
-def _predict(text: str) -> Dict[str, Any]:
+
+def _predict(text: str, debug: bool = False) -> Dict[str, Any]:
     if PIPELINE is not None:
         result = PIPELINE(text)[0]
-        debug: Dict[str, Any] = {
-            "input": text,
-            "input_length": len(text),
-            "model_class": "transformers.pipeline",
-            "confidence": float(result.get("score", 0.0)),
-            "confidence_label": str(result.get("label", "")),
-        }
-        return {
-            "sentiment": str(result.get("label", "")),
-            "debug": debug,
-        }
+        output: Dict[str, Any] = {"sentiment": str(result.get("label", ""))}
+        if debug:
+            output["debug"] = {
+                "input": text,
+                "input_length": len(text),
+                "model_class": "transformers.pipeline",
+                "confidence": float(result.get("score", 0.0)),
+                "confidence_label": str(result.get("label", "")),
+            }
+        return output
 
     if MODEL is None or VECTORIZER is None:
         raise RuntimeError(MODEL_ERROR or "Model not loaded")
 
-    cleaned = _basic_preprocess(text)
-    X = VECTORIZER.transform([cleaned])
-    pred = MODEL.predict(X)[0]
-
-    debug: Dict[str, Any] = {
-        "input": text,
-        "input_length": len(text),
-        "cleaned_length": len(cleaned),
-        "vector_shape": list(X.shape),
-        "model_class": MODEL.__class__.__name__,
-        "vectorizer_class": VECTORIZER.__class__.__name__,
-    }
+    if BATCH_WINDOW_MS > 0:
+        return _predict_batched(text, debug)
+    return _predict_rows([text], debug)[0]
+
+
+def _classify(texts: list[str], with_scores: bool) -> tuple[Any, Iterator[tuple]]:
+    # One transform/predict call for all texts. Returns X and per-row
+    # (raw, cleaned, pred, probs, scores) tuples; scores are None unless asked.
+    cleaned_list = [_basic_preprocess(t) for t in texts]
+    if len(cleaned_list) == 1:
+        X = _vectorize_cached(cleaned_list[0])
+    else:
+        X = VECTORIZER.transform(cleaned_list)
+    preds = MODEL.predict(X).tolist()
+    probs, scores = _score_rows(X) if with_scores else (None, None)
+    rows = zip(texts, cleaned_list, preds, probs or repeat(None), scores or repeat(None))
+    return X, rows
+
+
+def _predict_rows(texts: list[str], debug: bool = False) -> list[Dict[str, Any]]:
+    # Formatted like single predictions; used by the batch worker.
+    X, rows = _classify(texts, debug)
+    if not debug:
+        return [{"sentiment": str(pred)} for _, _, pred, _, _ in rows]
+
+    results = []
+    for raw, cleaned, pred, prob_row, score_row in rows:
+        row_debug: Dict[str, Any] = {
+            "input": raw,
+            "input_length": len(raw),
+            "cleaned_length": len(cleaned),
+            "vector_shape": [1, X.shape[1]],
+            "model_class": MODEL.__class__.__name__,
+            "vectorizer_class": VECTORIZER.__class__.__name__,
+        }
+        _attach_scores(row_debug, prob_row, score_row)
+        results.append({"sentiment": str(pred), "debug": row_debug})
+
+    return results
 
-    # Best-effort score/proba
-    if hasattr(MODEL, "predict_proba"):
-        probs = MODEL.predict_proba(X)[0]
-        classes = list(getattr(MODEL, "classes_", []))
-        debug["probabilities"] = {str(c): float(p) for c, p in zip(classes, probs)}
+
+def _score_rows(X: Any) -> tuple[list | None, list | None]:
+    # Best-effort score/proba, converted to Python lists in one C-level call.
+    if HAS_PROBA:
+        return MODEL.predict_proba(X).tolist(), None
+    if HAS_DECISION:
+        return None, MODEL.decision_function(X).tolist()
+    return None, None
+
+
+def _attach_scores(debug: Dict[str, Any], probs: Any, scores: Any) -> None:
+    classes = CLASS_STR_LIST
+    if probs is not None:
+        debug["probabilities"] = dict(zip(classes, probs))
         if len(probs) == len(classes) and len(classes) > 0:
-            best_idx = int(probs.argmax())
-            debug["confidence"] = float(probs[best_idx])
-            debug["confidence_label"] = str(classes[best_idx])
-    elif hasattr(MODEL, "decision_function"):
-        scores = MODEL.decision_function(X)
-        try:
-            scores = scores[0]
-        except Exception:
-            pass
-        debug["decision_scores"] = scores.tolist() if hasattr(scores, "tolist") else scores
+            best_idx = probs.index(max(probs))
+            debug["confidence"] = probs[best_idx]
+            debug["confidence_label"] = classes[best_idx]
+    elif scores is not None:
+        debug["decision_scores"] = scores
+        # Binary models give a single scalar score per row
+        if isinstance(scores, list) and len(scores) > 0 and len(classes) == len(scores):
+            best_idx = scores.index(max(scores))
+            debug["confidence"] = scores[best_idx]
+            debug["confidence_label"] = classes[best_idx]
+
+
+_BATCH_QUEUE: "queue.Queue[tuple[str, bool, float, threading.Event, list]]" = queue.Queue()
+_BATCH_WORKER: threading.Thread | None = None
+_BATCH_LOCK = threading.Lock()
+
+
+def _batch_worker() -> None:
+    window = BATCH_WINDOW_MS / 1000.0
+    last_arrival = float("-inf")
+    while True:
+        batch = [_BATCH_QUEUE.get()]
+        arrival = batch[0][2]
+        # Hold the batch open for the window only under load: when others are
+        # already queued, or the previous request arrived within one window.
+        # A lone request is flushed straight away.
+        busy = not _BATCH_QUEUE.empty() or arrival - last_arrival < window
+        deadline = arrival + window if busy else 0.0
+        while len(batch) < BATCH_MAX_SIZE:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(_BATCH_QUEUE.get(timeout=remaining))
+            except queue.Empty:
+                break
+        last_arrival = batch[-1][2]
+
+        # Build debug payloads only if some caller in the batch asked for them.
+        want_debug = any(item[1] for item in batch)
         try:
-            # Best-effort confidence from decision scores
-            if hasattr(scores, "__len__") and len(scores) > 0:
-                best_idx = int(scores.argmax())  # type: ignore[attr-defined]
-                classes = list(getattr(MODEL, "classes_", []))
-                if len(classes) == len(scores):
-                    debug["confidence"] = float(scores[best_idx])
-                    debug["confidence_label"] = str(classes[best_idx])
-        except Exception:
-            pass
+            outputs: list[Any] = _predict_rows([item[0] for item in batch], want_debug)
+        except Exception as exc:
+            outputs = [exc] * len(batch)
+        for (_, debug, _, done, box), out in zip(batch, outputs):
+            if want_debug and not debug and isinstance(out, dict):
+                out.pop("debug", None)
+            box.append(out)
+            done.set()
+
+
+def _ensure_batch_worker() -> None:
+    # Started lazily so each (forked) server worker process gets its own thread.
+    global _BATCH_WORKER
+    with _BATCH_LOCK:
+        if _BATCH_WORKER is None or not _BATCH_WORKER.is_alive():
+            _BATCH_WORKER = threading.Thread(
+                target=_batch_worker, name="predict-batcher", daemon=True
+            )
+            _BATCH_WORKER.start()
 
-    return {
-        "sentiment": str(pred),
-        "debug": debug,
-    }
 
+def _predict_batched(text: str, debug: bool = False) -> Dict[str, Any]:
+    _ensure_batch_worker()
+    done = threading.Event()
+    box: list[Any] = []
+    _BATCH_QUEUE.put((text, debug, time.monotonic(), done, box))
+    if not done.wait(BATCH_TIMEOUT_S):
+        raise RuntimeError("Prediction timed out")
+    out = box[0]
+    if isinstance(out, Exception):
+        raise out
+    return out
 
-def _predict_many(texts: list[str]) -> Dict[str, Any]:
+
+def _predict_many(texts: list[str], debug: bool = False) -> Dict[str, Any]:
     if PIPELINE is not None:
         outputs = PIPELINE(texts)
         results = []
         for raw, out in zip(texts, outputs):
-            results.append(
-                {
-                    "text": raw,
-                    "sentiment": str(out.get("label", "")),
-                    "debug": {
-                        "input_length": len(raw),
-                        "confidence": float(out.get("score", 0.0)),
-                        "confidence_label": str(out.get("label", "")),
-                    },
+            item: Dict[str, Any] = {"text": raw, "sentiment": str(out.get("label", ""))}
+            if debug:
+                item["debug"] = {
+                    "input_length": len(raw),
+                    "confidence": float(out.get("score", 0.0)),
+                    "confidence_label": str(out.get("label", "")),
                 }
-            )
+            results.append(item)
+        if not debug:
+            return {"results": results}
         return {
             "results": results,
             "debug": {
@@ -162,62 +398,28 @@ def _predict_many(texts: list[str]) -> Dict[str, Any]:
             },
         }
 
-    cleaned_list = [_basic_preprocess(t) for t in texts]
-    X = VECTORIZER.transform(cleaned_list)
-    preds = MODEL.predict(X)
-
-    debug: Dict[str, Any] = {
-        "inputs": texts,
-        "count": len(texts),
-        "vector_shape": list(X.shape),
-        "model_class": MODEL.__class__.__name__,
-        "vectorizer_class": VECTORIZER.__class__.__name__,
-    }
+    X, rows = _classify(texts, debug)
+    if not debug:
+        return {"results": [{"text": raw, "sentiment": str(pred)} for raw, _, pred, _, _ in rows]}
 
     results = []
-    for raw, cleaned, pred in zip(texts, cleaned_list, preds):
-        item = {
-            "text": raw,
-            "sentiment": str(pred),
-            "debug": {
-                "input_length": len(raw),
-                "cleaned_length": len(cleaned),
-            },
+    for raw, cleaned, pred, prob_row, score_row in rows:
+        item_debug: Dict[str, Any] = {
+            "input_length": len(raw),
+            "cleaned_length": len(cleaned),
         }
-        results.append(item)
-
-    if hasattr(MODEL, "predict_proba"):
-        probs = MODEL.predict_proba(X)
-        classes = list(getattr(MODEL, "classes_", []))
-        for item, row in zip(results, probs):
-            item["debug"]["probabilities"] = {
-                str(c): float(p) for c, p in zip(classes, row)
-            }
-            if len(row) == len(classes) and len(classes) > 0:
-                best_idx = int(row.argmax())
-                item["debug"]["confidence"] = float(row[best_idx])
-                item["debug"]["confidence_label"] = str(classes[best_idx])
-    elif hasattr(MODEL, "decision_function"):
-        scores = MODEL.decision_function(X)
-        try:
-            scores = scores.tolist()
-        except Exception:
-            pass
-        for item, row in zip(results, scores):
-            item["debug"]["decision_scores"] = row
-            try:
-                if hasattr(row, "__len__") and len(row) > 0:
-                    best_idx = int(row.index(max(row)))
-                    classes = list(getattr(MODEL, "classes_", []))
-                    if len(classes) == len(row):
-                        item["debug"]["confidence"] = float(row[best_idx])
-                        item["debug"]["confidence_label"] = str(classes[best_idx])
-            except Exception:
-                pass
+        _attach_scores(item_debug, prob_row, score_row)
+        results.append({"text": raw, "sentiment": str(pred), "debug": item_debug})
 
     return {
         "results": results,
-        "debug": debug,
+        "debug": {
+            "inputs": texts,
+            "count": len(texts),
+            "vector_shape": list(X.shape),
+            "model_class": MODEL.__class__.__name__,
+            "vectorizer_class": VECTORIZER.__class__.__name__,
+        },
     }
 
 
@@ -388,7 +590,7 @@ runBtn.onclick = async () => {
   runBtn.disabled = true;
   try {
     const body = values.length > 1 ? { texts: values } : { text: values[0] };
-    const res = await fetch('/api/predict', {
+    const res = await fetch('/api/predict?debug=1', {
       method: 'POST',
       headers: {'Content-Type': 'application/json'},
       body: JSON.stringify(body)
@@ -419,10 +621,21 @@ runBtn.onclick = async () => {
 </html>
 """
 
+# The page has no template variables, so encode it once and serve the bytes.
+_INDEX_BODY = INDEX_HTML.encode("utf-8")
+_INDEX_ETAG = hashlib.md5(_INDEX_BODY, usedforsecurity=False).hexdigest()
+_INDEX_HEADERS = {
+    "Cache-Control": "public, max-age=3600",
+    "ETag": f'"{_INDEX_ETAG}"',
+}
+
 
 @app.route("/")
-def index() -> str:
-    return render_template_string(INDEX_HTML)
+def index() -> Response:
+    # If-None-Match uses weak comparison (RFC 7232), so W/"..." also matches.
+    if request.if_none_match.contains_weak(_INDEX_ETAG):
+        return Response(status=304, headers=_INDEX_HEADERS)
+    return Response(_INDEX_BODY, mimetype="text/html", headers=_INDEX_HEADERS)
 
 
 @app.route("/health")
@@ -440,9 +653,14 @@ def health() -> Any:
 
 @app.route("/api/predict", methods=["POST"])
 def predict() -> Any:
-    if not request.is_json:
+    # Decode the raw body directly (orjson via app.json) instead of get_json().
+    try:
+        payload = app.json.loads(request.get_data(cache=False)) or {}
+    except Exception:
         return jsonify({"error": "Expected JSON body"}), 400
-    payload = request.get_json(force=True) or {}
+    if not isinstance(payload, dict):
+        return jsonify({"error": "Expected JSON body"}), 400
+    want_debug = request.args.get("debug") == "1"
     text = payload.get("text", "")
     texts = payload.get("texts", None)
     if texts is not None:
@@ -452,7 +670,7 @@ def predict() -> Any:
         if not normalized:
             return jsonify({"error": "All texts are empty"}), 400
         try:
-            result = _predict_many(normalized)
+            result = _predict_many(normalized, debug=want_debug)
             return jsonify(result)
         except Exception as exc:
             return jsonify({"error": str(exc)}), 500
@@ -461,12 +679,50 @@ def predict() -> Any:
     if not text.strip():
         return jsonify({"error": "Text is required"}), 400
     try:
-        result = _predict(text)
+        result = _predict(text, debug=want_debug)
         return jsonify(result)
     except Exception as exc:
         return jsonify({"error": str(exc)}), 500
 
 
-if __name__ == "__main__":
+_LOAD_LOCK = threading.Lock()
+
+
+@app.before_request
+def _ensure_assets() -> None:
+    # Load on first use when no load has completed (or failed) yet.
+    if _ASSETS_LOADED:
+        return
+    with _LOAD_LOCK:
+        if not _ASSETS_LOADED:
+            _load_assets()
+
+
+# Load at import so `gunicorn --preload` loads once in the master and forked
+# workers share the (memory-mapped) model pages copy-on-write. The transformer
+# model is left to each worker's first request: forking after torch has started
+# its thread pool can hang the workers.
+if os.environ.get("PRELOAD_MODELS", "1") == "1" and not _has_transformer():
     _load_assets()
-    app.run(host="0.0.0.0", port=int(os.environ.get("PORT", 8000)), debug=True)
+
+
+def _serve() -> None:
+    port = int(os.environ.get("PORT", 8000))
+    if os.environ.get("FLASK_ENV") == "development":
+        app.run(host="0.0.0.0", port=port, debug=True)
+        return
+    try:
+        import uvicorn
+        from a2wsgi import WSGIMiddleware
+    except Exception:  # pragma: no cover
+        # Production server not installed; fall back to the threaded dev server.
+        app.run(host="0.0.0.0", port=port, threaded=True)
+        return
+    # a2wsgi runs requests on a thread pool, so one slow prediction does not
+    # block the others. "auto" prefers httptools.
+    uvicorn.run(WSGIMiddleware(app), host="0.0.0.0", port=port, log_level="warning", http="auto")
+
+
+if __name__ == "__main__":
+    _ensure_assets()
+    _serve()